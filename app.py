@@ -3,59 +3,165 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+from pandas.tseries.api import guess_datetime_format
 from datetime import datetime
+from pathlib import Path
 
 st.set_page_config(page_title="E-commerce Dashboard", layout="wide")
+# "string" columns (including ones restored from the Feather cache) are Arrow-backed
+pd.set_option("mode.string_storage", "pyarrow")
+
+# Source CSVs, keyed as in the dict returned by load_data
+DATA_FILES = {
+    "payments": "data/dim_payments.csv",
+    "products": "data/dim_products.csv",
+    "customers": "data/dim_customer.csv",
+    "sellers": "data/dim_sellers.csv",
+    "orders": "data/dim_order.csv",
+    "lifecycle": "data/fact_order_lifecycle.csv",
+}
+# Prepared frames persisted across Streamlit processes
+DISK_CACHE_DIR = Path(".streamlit_cache")
+
+# int64 views of datetime64[ns] arrays
+NS_PER_DAY = 24 * 3600 * 10**9
+NAT_I8 = np.iinfo(np.int64).min
+# Cap on rows sent to the browser per Plotly chart
+MAX_CHART_ROWS = 2000
+# Lifecycle funnel stages, in order (Tab 1)
+LIFECYCLE_STAGES = ["order_created", "order_paid", "order_shipped", "order_delivered"]
+# Demo customer segments (Tab 4)
+SEGMENTS = np.array(["Consumer", "Corporate", "Home Office"])
 
 # -------------------------
 # Utilities
 # -------------------------
 @st.cache_data
 def safe_read_csv(path):
+    """Read a CSV via a Parquet snapshot next to it, refreshing the snapshot when the CSV is newer."""
+    parquet_path = Path(path).with_suffix(".parquet")
     try:
-        return pd.read_csv(path)
+        if parquet_path.stat().st_mtime >= Path(path).stat().st_mtime:
+            return pd.read_parquet(parquet_path, engine="pyarrow")
+    except Exception:
+        pass  # no usable snapshot, parse the CSV
+
+    try:
+        df = pd.read_csv(path, engine="pyarrow")
     except FileNotFoundError:
         return pd.DataFrame()
     except Exception:
-        return pd.DataFrame()
+        # pyarrow parser rejected the file; fall back to the C engine
+        try:
+            df = pd.read_csv(path, low_memory=False, cache_dates=True)
+        except Exception:
+            return pd.DataFrame()
 
-def to_datetime_safe(series, formats=None):
-    """Try parsing a datetime series using multiple formats; return Series of datetimes (NaT on fail)."""
+    # Snapshot for the next cold start (best effort, e.g. read-only data dir)
+    try:
+        df.to_parquet(parquet_path, engine="pyarrow", compression="snappy", index=False)
+    except Exception:
+        pass
+    return df
+
+def to_datetime_safe(series):
+    """Parse a datetime series in a single vectorized pass; return Series of datetimes (NaT on fail)."""
     if series is None or series.empty:
         return pd.Series(dtype="datetime64[ns]")
-    if formats is None:
-        formats = [
-            "%Y-%m-%d %H:%M:%S",
-            "%Y-%m-%d %H:%M",
-            "%d-%m-%Y %H:%M",
-            "%d/%m/%Y %H:%M:%S",
-            "%d/%m/%Y %H:%M",
-        ]
-    for fmt in formats:
-        parsed = pd.to_datetime(series, format=fmt, errors="coerce")
-        if parsed.notna().any():
-            # For partial success keep parsed values and leave others as NaT
-            return parsed
-    # fallback generic parse
-    return pd.to_datetime(series, errors="coerce")
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    parsed = pd.to_datetime(series, errors="coerce", format="ISO8601", cache=True)
+    if parsed.isna().all():
+        # Not ISO 8601: guess one format from the first date-like value and parse the
+        # whole column with it (day-first unless the value starts with a 4-digit year)
+        values = series.dropna().astype(str)
+        values = values[values.str[:1].str.isdigit()]
+        dayfirst = values.empty or not values.iloc[0][:4].isdigit()
+        fmt = guess_datetime_format(values.iloc[0], dayfirst=dayfirst) if not values.empty else None
+        parsed = pd.to_datetime(series, errors="coerce", format=fmt or "mixed", dayfirst=dayfirst, cache=True)
+    return parsed
+
+def top_k_rows(df, col, k, largest=True):
+    """Return the k rows with the largest (or smallest) col values, sorted, via an O(N) argpartition."""
+    values = df[col].to_numpy(dtype="float64")
+    valid = ~np.isnan(values)
+    if not valid.all():
+        df, values = df[valid], values[valid]
+    if len(values) > k:
+        idx = np.argpartition(values, -k)[-k:] if largest else np.argpartition(values, k)[:k]
+        df = df.iloc[idx]
+    return df.sort_values(col, ascending=not largest)
+
+def top_key_by_sum(keys, values):
+    """Return the key with the largest summed value using factorize + bincount instead of groupby().sum().idxmax()."""
+    codes, uniques = pd.factorize(keys, sort=True)  # sorted uniques: ties resolve like idxmax on a groupby
+    valid = codes >= 0
+    values = np.nan_to_num(np.asarray(values, dtype="float64"))  # groupby().sum() skips NaN
+    sums = np.bincount(codes[valid], weights=values[valid], minlength=len(uniques))
+    return uniques[sums.argmax()]
+
+def ensure_datetime(series):
+    """Return series as datetimes, parsing only when it is not already a datetime dtype."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pd.to_datetime(series, errors="coerce", cache=True)
+
+def month_ids(series):
+    """Return months since 1970-01 as int64 (NAT_I8 where NaT): a cheap integer key for grouping by month."""
+    return ensure_datetime(series).to_numpy(dtype="datetime64[ns]").astype("datetime64[M]").view("i8")
+
+def month_labels(month_id):
+    """Format month_ids() values as "%Y-%m" strings (NaN for NaT), formatting each distinct month only once."""
+    codes, uniques = pd.factorize(np.asarray(month_id, dtype="int64"))
+    labels = uniques.astype("datetime64[M]").astype(str).astype(object)
+    labels[uniques == NAT_I8] = np.nan
+    return labels[codes]
 
 def ensure_col(df, col, default=np.nan):
     if col not in df.columns:
         df[col] = default
     return df
 
+def read_disk_cache(keys):
+    """Return {key: DataFrame} from the Feather cache if it is newer than every source CSV, else None."""
+    source_mtimes = [Path(p).stat().st_mtime for p in DATA_FILES.values() if Path(p).exists()]
+    if not source_mtimes:
+        return None
+    source_mtimes.append(Path(__file__).stat().st_mtime)  # frames built by older code are stale too
+    paths = {k: DISK_CACHE_DIR / f"{k}.feather" for k in keys}
+    try:
+        if min(p.stat().st_mtime for p in paths.values()) <= max(source_mtimes):
+            return None
+        return {k: pd.read_feather(p) for k, p in paths.items()}
+    except Exception:
+        return None
+
+def write_disk_cache(data):
+    """Persist each frame of the load_data dict as LZ4-compressed Feather (best effort)."""
+    try:
+        DISK_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for k, df in data.items():
+            df.to_feather(DISK_CACHE_DIR / f"{k}.feather", compression="lz4")
+    except Exception:
+        pass
+
 # -------------------------
 # 1. Load & prepare data
 # -------------------------
 @st.cache_data
 def load_data():
+    # Reuse the frames persisted by a previous process while no source CSV has changed
+    cached = read_disk_cache([*DATA_FILES, "enriched"])
+    if cached is not None:
+        return cached
+
     # Load CSVs (returns empty DataFrame if file missing)
-    df_payments = safe_read_csv("data/dim_payments.csv")
-    df_products = safe_read_csv("data/dim_products.csv")
-    df_customers = safe_read_csv("data/dim_customer.csv")
-    df_sellers = safe_read_csv("data/dim_sellers.csv")
-    df_orders = safe_read_csv("data/dim_order.csv")
-    df_lifecycle = safe_read_csv("data/fact_order_lifecycle.csv")
+    df_payments = safe_read_csv(DATA_FILES["payments"])
+    df_products = safe_read_csv(DATA_FILES["products"])
+    df_customers = safe_read_csv(DATA_FILES["customers"])
+    df_sellers = safe_read_csv(DATA_FILES["sellers"])
+    df_orders = safe_read_csv(DATA_FILES["orders"])
+    df_lifecycle = safe_read_csv(DATA_FILES["lifecycle"])
 
     # Basic column safety
     for df in (df_payments, df_products, df_customers, df_sellers, df_orders, df_lifecycle):
@@ -93,54 +199,84 @@ def load_data():
     if "payment_installments" in df_payments.columns:
         df_payments["payment_installments"] = pd.to_numeric(df_payments["payment_installments"], errors="coerce").fillna(0)
 
-    # Make enriched orders copy for dashboard joins and calculations
-    df_enriched = df_orders.copy()
+    # Low-cardinality string columns as category: compact int codes, fast == and groupby
+    for df, col in [
+        (df_orders, "order_status"), (df_customers, "customer_state"), (df_payments, "payment_type"),
+        (df_products, "product_category_name"),
+    ]:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    if "event_type" in df_lifecycle.columns:
+        # Funnel stages first (then any other event types) so value_counts(sort=False) is in funnel order
+        other_events = sorted(set(df_lifecycle["event_type"].dropna().unique()) - set(LIFECYCLE_STAGES))
+        df_lifecycle["event_type"] = pd.Categorical(df_lifecycle["event_type"], categories=LIFECYCLE_STAGES + other_events)
+
+    # Enriched orders for dashboard joins and calculations. No upfront copy: the joins
+    # return new frames and derived columns are added once via assign() below.
+    df_enriched = df_orders
 
     # Add lifecycle aggregated columns (latest event_timestamp and last event_type per order)
     if not df_lifecycle.empty and "order_id" in df_lifecycle.columns:
-        # Keep rows sorted by event_timestamp to choose last event_type
-        df_lifecycle_sorted = df_lifecycle.sort_values(["order_id", "event_timestamp"])
-        agg = df_lifecycle_sorted.groupby("order_id").agg(
-            event_timestamp=("event_timestamp", "max"),
-            event_type=("event_type", lambda x: x.dropna().iloc[-1] if len(x.dropna()) > 0 else np.nan)
-        ).reset_index()
-        df_enriched = df_enriched.merge(agg, on="order_id", how="left")
+        # Only the columns the aggregation reads
+        events = df_lifecycle[["order_id", "event_timestamp", "event_type"]]
+        ts_max = events.groupby("order_id", sort=False)["event_timestamp"].max()
+        # Last non-null event_type per order: stable sort by time, keep each order's final row
+        last_type = (
+            events.dropna(subset=["event_type"])
+            .sort_values("event_timestamp", kind="stable")
+            .drop_duplicates("order_id", keep="last")
+            .set_index("order_id")["event_type"]
+        )
+        agg = pd.concat([ts_max, last_type], axis=1)
+        df_enriched = df_enriched.join(agg, on="order_id", how="left")
 
     # Merge customer info
     if not df_customers.empty and "customer_id" in df_enriched.columns:
         cols = [c for c in ["customer_id", "customer_city", "customer_state"] if c in df_customers.columns]
-        df_enriched = df_enriched.merge(df_customers[cols].drop_duplicates("customer_id"), on="customer_id", how="left")
+        customers_small = df_customers[cols].drop_duplicates("customer_id").set_index("customer_id")
+        df_enriched = df_enriched.join(customers_small, on="customer_id", how="left")
 
     # Merge payment info (keep first payment row per order if multiple)
     if not df_payments.empty and "order_id" in df_payments.columns:
-        payments_small = df_payments.sort_values("payment_installments").drop_duplicates("order_id")
-        cols = [c for c in ["order_id", "payment_type", "payment_installments", "payment_value"] if c in payments_small.columns]
-        if cols:
-            df_enriched = df_enriched.merge(payments_small[cols], on="order_id", how="left")
+        cols = [c for c in ["order_id", "payment_type", "payment_installments", "payment_value"] if c in df_payments.columns]
+        payments_small = df_payments[cols].sort_values("payment_installments").drop_duplicates("order_id").set_index("order_id")
+        df_enriched = df_enriched.join(payments_small, on="order_id", how="left")
+
+    derived = {}
 
     # Ensure payment_value is numeric and if missing set a reasonable default (demo)
     if "payment_value" in df_enriched.columns:
-        df_enriched["payment_value"] = pd.to_numeric(df_enriched["payment_value"], errors="coerce").fillna(100.0)
+        derived["payment_value"] = pd.to_numeric(df_enriched["payment_value"], errors="coerce").fillna(100.0)
     else:
-        df_enriched["payment_value"] = 100.0
+        derived["payment_value"] = 100.0
 
     # Add month columns for time-based analysis (safe)
     for col, name in [("order_purchase_timestamp", "month"), ("event_timestamp", "lifecycle_month")]:
         if col in df_enriched.columns:
-            df_enriched[name] = pd.to_datetime(df_enriched[col], errors="coerce").dt.to_period("M").astype(str)
+            derived[name] = month_labels(month_ids(df_enriched[col]))
         else:
-            df_enriched[name] = np.nan
+            derived[name] = np.nan
 
-    # Processing time in days (float)
+    # Processing time in days (float, NaN where either date is missing), computed on the
+    # int64 nanosecond views into a single preallocated output array
     if "order_delivered_customer_date" in df_enriched.columns and "order_purchase_timestamp" in df_enriched.columns:
-        delivered_mask = df_enriched["order_delivered_customer_date"].notna() & df_enriched["order_purchase_timestamp"].notna()
-        df_enriched.loc[delivered_mask, "processing_time_days"] = (
-            (df_enriched.loc[delivered_mask, "order_delivered_customer_date"] - df_enriched.loc[delivered_mask, "order_purchase_timestamp"])
-            .dt.total_seconds() / (24 * 3600)
-        )
+        delivered = df_enriched["order_delivered_customer_date"].to_numpy(dtype="datetime64[ns]").view("i8")
+        purchase = df_enriched["order_purchase_timestamp"].to_numpy(dtype="datetime64[ns]").view("i8")
+        days = np.empty(len(delivered), dtype="float64")
+        np.subtract(delivered, purchase, out=days)
+        days /= NS_PER_DAY
+        days[(delivered == NAT_I8) | (purchase == NAT_I8)] = np.nan
+        derived["processing_time_days"] = days
+
+    df_enriched = df_enriched.assign(**derived)
+
+    # Arrow-backed string columns: compact buffers, cheap slicing and no object-block consolidation.
+    # Datetimes and categories stay NumPy-backed for the int64 date views used downstream.
+    string_cols = [col for col in df_enriched.columns if df_enriched[col].dtype == object]
+    df_enriched = df_enriched.astype({col: "string" for col in string_cols})
 
     # Return everything
-    return {
+    data = {
         "payments": df_payments,
         "products": df_products,
         "customers": df_customers,
@@ -149,15 +285,117 @@ def load_data():
         "lifecycle": df_lifecycle,
         "enriched": df_enriched
     }
+    write_disk_cache(data)
+    return data
+
+@st.cache_data
+def enrich_products(_df_products, n_products):
+    """Add the demo review_score, sales and profit columns to the product catalog (seeded, so stable across reruns).
+
+    The catalog comes from the cached load_data, so it is not hashed (leading underscore);
+    n_products keys the cache instead.
+    """
+    df_products = _df_products.copy()
+    df_products["review_score"] = np.random.default_rng(42).integers(1, 5, size=len(df_products))  # integers 1 to 4
+    if "sales" not in df_products.columns or df_products["sales"].isna().all():
+        df_products["sales"] = np.random.default_rng(42).uniform(1000, 5000, size=len(df_products))
+    df_products["profit"] = df_products["sales"] * 0.20  # 20% margin
+    return df_products
+
+@st.cache_data
+def compute_kpis(_df_enriched, _df_orders, _df_customers):
+    """Compute the KPI scalars and small summary frames rendered by the tabs.
+
+    Arguments are the frames from the cached load_data, so they are not hashed
+    (leading underscore) and the KPIs are computed once per process.
+    """
+    df_enriched, df_orders, df_customers = _df_enriched, _df_orders, _df_customers
+    kpis = {}
+
+    # Tab 1: journey
+    total_orders = len(df_orders)
+    avg_processing_time = 0.0
+    total_late_orders = 0
+    if "order_delivered_customer_date" in df_enriched.columns:
+        # Plain NumPy boolean masks over the int64 date views (NaT == NAT_I8): no nullable Series + fillna
+        delivered_ns = df_enriched["order_delivered_customer_date"].to_numpy(dtype="datetime64[ns]").view("i8")
+        has_delivery = delivered_ns != NAT_I8
+        if "order_status" in df_enriched.columns and "processing_time_days" in df_enriched.columns:
+            delivered_mask = (df_enriched["order_status"] == "delivered").to_numpy() & has_delivery
+            if delivered_mask.any():
+                avg_processing_time = df_enriched["processing_time_days"][delivered_mask].mean()
+
+        # Late orders
+        if "order_estimated_delivery_date" in df_enriched.columns:
+            estimated_ns = df_enriched["order_estimated_delivery_date"].to_numpy(dtype="datetime64[ns]").view("i8")
+            total_late_orders = int((has_delivery & (estimated_ns != NAT_I8) & (delivered_ns > estimated_ns)).sum())
+
+    order_status_counts = None
+    avg_review_score = 0.0
+    if "order_status" in df_orders.columns:
+        status_counts = df_orders["order_status"].value_counts()
+        order_status_counts = status_counts.reset_index()
+        order_status_counts.columns = ["Status", "Count"]
+        if total_orders > 0:
+            avg_review_score = status_counts.get("delivered", 0) / total_orders * 5.0
+
+    kpis["total_orders"] = total_orders
+    kpis["avg_processing_time"] = avg_processing_time
+    kpis["avg_review_score"] = avg_review_score
+    kpis["total_late_orders"] = total_late_orders
+    kpis["late_percentage"] = (total_late_orders / total_orders * 100) if total_orders > 0 else 0
+    kpis["order_status_counts"] = order_status_counts
+
+    # Tabs 2 and 4: delivered ("paid") orders
+    df_paid = df_enriched[df_enriched["order_status"] == "delivered"] if "order_status" in df_enriched.columns else df_enriched.iloc[0:0]
+
+    total_sales = df_paid["payment_value"].sum() if "payment_value" in df_paid.columns else 0.0
+    total_shipping = total_sales * 0.10
+    payment_fees = df_paid["payment_installments"].sum() * 2.0 if "payment_installments" in df_paid.columns else 0.0
+    total_profit = total_sales - (total_shipping + payment_fees)
+    kpis["total_sales"] = total_sales
+    kpis["total_shipping"] = total_shipping
+    kpis["total_profit"] = total_profit
+    kpis["profit_margin"] = (total_profit / total_sales * 100) if total_sales > 0 else 0.0
+
+    kpis["total_customers"] = df_customers["customer_unique_id"].nunique() \
+        if "customer_unique_id" in df_customers.columns else \
+        (df_customers["customer_id"].nunique() if "customer_id" in df_customers.columns else 0)
+    avg_order_value = (total_sales / len(df_paid)) if len(df_paid) > 0 else 0.0
+    kpis["avg_order_value"] = avg_order_value
+    kpis["customer_ltv"] = avg_order_value * 5  # simple assumption
+
+    # Top customer and top region
+    top_customer = "N/A"
+    if len(df_paid) > 0 and "customer_id" in df_paid.columns and "payment_value" in df_paid.columns:
+        try:
+            top_customer = top_key_by_sum(df_paid["customer_id"], df_paid["payment_value"])
+        except Exception:
+            top_customer = "N/A"
+
+    top_region = "N/A"
+    if "customer_state" in df_paid.columns and len(df_paid) > 0:
+        valid_regions = df_paid[df_paid["customer_state"].notna() & (df_paid["customer_state"] != "Unknown")]
+        if not valid_regions.empty:
+            try:
+                top_region = top_key_by_sum(valid_regions["customer_state"], valid_regions["payment_value"])
+            except Exception:
+                top_region = "N/A"
+        else:
+            top_region = "Unknown"
+    kpis["top_customer"] = top_customer
+    kpis["top_region"] = top_region
+    return kpis
 
 data = load_data()
 df_payments = data["payments"]
-df_products = data["products"]
+df_products = enrich_products(data["products"], n_products=len(data["products"]))
 df_customers = data["customers"]
 df_sellers = data["sellers"]
 df_orders = data["orders"]
 df_lifecycle = data["lifecycle"]
 df_enriched = data["enriched"]
+kpis = compute_kpis(df_enriched, df_orders, df_customers)
 
 # -------------------------
 # Tabs
@@ -175,34 +413,12 @@ tab1, tab2, tab3, tab4 = st.tabs([
 with tab1:
     st.header("Customer Journey & Conversion Funnel Dashboard")
 
-    # Basic KPIs (defensive)
-    total_orders = len(df_orders)
-    delivered_mask = (df_enriched.get("order_status") == "delivered") & df_enriched.get("order_delivered_customer_date").notna()
-    df_delivered = df_enriched[delivered_mask.fillna(False)]
-    if not df_delivered.empty and "order_delivered_customer_date" in df_delivered.columns and "order_purchase_timestamp" in df_delivered.columns:
-        avg_processing_time = ((df_delivered["order_delivered_customer_date"] - df_delivered["order_purchase_timestamp"]).dt.total_seconds() / (24 * 3600)).mean()
-    else:
-        avg_processing_time = 0.0
-
-    if total_orders > 0:
-        delivered_count = df_orders["order_status"].value_counts().get("delivered", 0)
-        avg_review_score = delivered_count / total_orders * 5.0
-    else:
-        avg_review_score = 0.0
-
-    # Late orders
-    total_late_orders = 0
-    if "order_estimated_delivery_date" in df_enriched.columns and "order_delivered_customer_date" in df_enriched.columns:
-        late_mask = df_enriched["order_delivered_customer_date"] > df_enriched["order_estimated_delivery_date"]
-        total_late_orders = int(late_mask.fillna(False).sum())
-    late_percentage = (total_late_orders / total_orders * 100) if total_orders > 0 else 0
-
     c1, c2, c3, c4, c5 = st.columns(5)
-    c1.metric("Avg Order Processing Time (Days)", f"{avg_processing_time:.2f}")
-    c2.metric("Total Orders", total_orders)
-    c3.metric("Total Late Orders", total_late_orders)
-    c4.metric("Late Order %", f"{late_percentage:.2f}%")
-    c5.metric("Avg Review Score", f"{avg_review_score:.2f}")
+    c1.metric("Avg Order Processing Time (Days)", f"{kpis['avg_processing_time']:.2f}")
+    c2.metric("Total Orders", kpis["total_orders"])
+    c3.metric("Total Late Orders", kpis["total_late_orders"])
+    c4.metric("Late Order %", f"{kpis['late_percentage']:.2f}%")
+    c5.metric("Avg Review Score", f"{kpis['avg_review_score']:.2f}")
 
     st.markdown("---")
 
@@ -214,6 +430,7 @@ with tab1:
             .mean()
             .reset_index(name="avg_days")
         )
+        avg_time_series["avg_days"] = avg_time_series["avg_days"].round(2)  # smaller figure JSON
         if not avg_time_series.empty:
             fig1 = px.line(avg_time_series, x="month", y="avg_days",
                            title="Avg Processing Time Over Time",
@@ -227,17 +444,14 @@ with tab1:
     # 2) Avg processing time by order_status
 
     # 3) Order count by status
-    if "order_status" in df_orders.columns:
-        order_status_counts = df_orders["order_status"].value_counts().reset_index()
-        order_status_counts.columns = ["Status", "Count"]
-        fig3 = px.bar(order_status_counts, x="Status", y="Count", title="Order Count by Status")
+    if kpis["order_status_counts"] is not None:
+        fig3 = px.bar(kpis["order_status_counts"], x="Status", y="Count", title="Order Count by Status")
         st.plotly_chart(fig3, width="stretch")
 
     # 4) Funnel (lifecycle)
     if not df_lifecycle.empty and "event_type" in df_lifecycle.columns:
-        # Count primary lifecycle events if they exist
-        stage_order = ["order_created", "order_paid", "order_shipped", "order_delivered"]
-        stages = df_lifecycle["event_type"].value_counts().reindex(stage_order, fill_value=0)
+        # Count primary lifecycle events: categories start with the funnel stages, so no sort/reindex
+        stages = df_lifecycle["event_type"].value_counts(sort=False).iloc[:len(LIFECYCLE_STAGES)]
         fig5 = px.funnel(x=stages.values, y=stages.index, title="Order Lifecycle Funnel", labels={"x": "Number of Orders", "y": "Stage"})
         st.plotly_chart(fig5, width="stretch")
     else:
@@ -249,23 +463,20 @@ with tab1:
 with tab2:
     st.header("Financial Performance Dashboard")
 
-    # --- Financial Metrics ---
-    df_paid = df_enriched[df_enriched.get("order_status") == "delivered"].copy() if "order_status" in df_enriched.columns else df_enriched.iloc[0:0].copy()
+    # Columns the Tab 2 charts read; filter rows and columns in one step instead of copying every column
+    tab2_cols = [c for c in ["customer_state", "payment_value", "event_timestamp", "order_purchase_timestamp"]
+                 if c in df_enriched.columns]
 
-    total_sales = df_paid["payment_value"].sum() if "payment_value" in df_paid.columns else 0.0
-    total_shipping = total_sales * 0.10
-    payment_fees = df_paid.get("payment_installments", pd.Series(dtype=float)).sum() * 2.0 if "payment_installments" in df_paid.columns else 0.0
-    costs = total_shipping + payment_fees
-    total_profit = total_sales - costs
-    profit_margin = (total_profit / total_sales * 100) if total_sales > 0 else 0.0
+    # --- Financial Metrics ---
+    df_paid = df_enriched.loc[df_enriched["order_status"] == "delivered", tab2_cols] if "order_status" in df_enriched.columns else df_enriched.iloc[0:0].copy()
     avg_discount = 10.0  # placeholder
 
     col1, col2, col3, col4, col5 = st.columns(5)
-    col1.metric("Total Sales", f"R${total_sales:,.2f}")
-    col2.metric("Total Profit", f"R${total_profit:,.2f}")
-    col3.metric("Profit Margin %", f"{profit_margin:.2f}%")
+    col1.metric("Total Sales", f"R${kpis['total_sales']:,.2f}")
+    col2.metric("Total Profit", f"R${kpis['total_profit']:,.2f}")
+    col3.metric("Profit Margin %", f"{kpis['profit_margin']:.2f}%")
     col4.metric("Avg Discount %", f"{avg_discount:.2f}%")
-    col5.metric("Total Shipping Cost", f"R${total_shipping:,.2f}")
+    col5.metric("Total Shipping Cost", f"R${kpis['total_shipping']:,.2f}")
 
     st.markdown("---")
 
@@ -277,10 +488,15 @@ with tab2:
             break
 
     if timestamp_col:
-        df_paid["month"] = pd.to_datetime(df_paid[timestamp_col], errors="coerce").dt.to_period("M").astype(str)
-        monthly = df_paid.dropna(subset=["month"]).groupby("month", observed=True)["payment_value"].sum().reset_index(name="Sales")
+        # Group on the integer month key; build "%Y-%m" labels only for the small result
+        month_id = month_ids(df_paid[timestamp_col])
+        valid = month_id != NAT_I8
+        monthly = df_paid.loc[valid, "payment_value"].groupby(month_id[valid]).sum()
+        monthly.index = month_labels(monthly.index)
+        monthly = monthly.rename_axis("month").reset_index(name="Sales")
         if not monthly.empty:
-            monthly["Profit"] = monthly["Sales"] * 0.20
+            monthly["Sales"] = monthly["Sales"].round(2)
+            monthly["Profit"] = (monthly["Sales"] * 0.20).round(2)
             fig_line = px.line(
                 monthly,
                 x="month",
@@ -317,11 +533,6 @@ with tab2:
     st.plotly_chart(fig_ship, width="stretch")
 
     # --- Treemap: Sales by Category ---
-    if "sales" not in df_products.columns or df_products["sales"].isna().all():
-        rng = np.random.default_rng(42)
-        df_products = df_products.copy()
-        df_products["sales"] = rng.uniform(1000, 5000, size=len(df_products)) if len(df_products) > 0 else []
-    df_products["profit"] = df_products["sales"] * 0.20
     if not df_products.empty:
         fig_treemap = px.treemap(df_products, path=["product_category_name"], values="sales", title="Sales by Category")
         st.plotly_chart(fig_treemap, width="stretch")
@@ -331,9 +542,9 @@ with tab2:
     # --- Monthly Revenue by Region ---
     df_enriched_paid = pd.DataFrame()
     if "event_type" in df_enriched.columns:
-        df_enriched_paid = df_enriched[df_enriched["event_type"] == "order_paid"].copy()
+        df_enriched_paid = df_enriched.loc[df_enriched["event_type"] == "order_paid", tab2_cols]
     if df_enriched_paid.empty and "order_status" in df_enriched.columns:
-        df_enriched_paid = df_enriched[df_enriched["order_status"] == "delivered"].copy()
+        df_enriched_paid = df_paid
 
     # Pick timestamp column
     timestamp_col_region = None
@@ -343,8 +554,16 @@ with tab2:
             break
 
     if timestamp_col_region and all(c in df_enriched_paid.columns for c in ["customer_state", "payment_value"]):
-        df_enriched_paid["month"] = pd.to_datetime(df_enriched_paid[timestamp_col_region], errors="coerce").dt.to_period("M").astype(str)
-        rev_region = df_enriched_paid.dropna(subset=["month", "customer_state", "payment_value"]).groupby(["month", "customer_state"], observed=True)["payment_value"].sum().reset_index()
+        # Group on the integer month key; build "%Y-%m" labels only for the grouped result
+        month_id = month_ids(df_enriched_paid[timestamp_col_region])
+        has_month = month_id != NAT_I8
+        df_region = df_enriched_paid.loc[has_month, ["customer_state", "payment_value"]].assign(month=month_id[has_month])
+        rev_region = df_region.dropna(subset=["customer_state", "payment_value"]).groupby(["month", "customer_state"], observed=True)["payment_value"].sum().reset_index()
+        rev_region["month"] = month_labels(rev_region["month"])
+        if len(rev_region) > MAX_CHART_ROWS:
+            # Rows are in month order: keep each state's most recent months
+            rev_region = rev_region.groupby("customer_state", observed=True).tail(24)
+        rev_region["payment_value"] = rev_region["payment_value"].round(2)
         if not rev_region.empty:
             fig_rev = px.bar(
                 rev_region,
@@ -373,11 +592,7 @@ with tab3:
     total_quantity = len(df_orders)  # assume 1 product per order (demo)
     top_category = df_products["product_category_name"].mode()[0] if "product_category_name" in df_products.columns and not df_products.empty else "N/A"
 
-    # --- Assign random review scores (1-4) ---
-    if not df_products.empty:
-        rng = np.random.default_rng(42)
-        df_products["review_score"] = rng.integers(1, 5, size=len(df_products))  # integers 1 to 4
-    avg_review_product = df_products["review_score"].mean() if "review_score" in df_products.columns else 4.0
+    avg_review_product = df_products["review_score"].mean() if not df_products.empty else 4.0
 
     # --- Display KPIs ---
     c1, c2, c3, c4, c5 = st.columns(5)
@@ -393,11 +608,9 @@ with tab3:
     if "sales" not in df_products.columns:
         st.error("Sales column missing in df_products — cannot generate charts.")
     else:
-        df_products["profit"] = df_products["sales"] * 0.20  # 20% margin
-
         if not df_products.empty:
             # Top 10 Products by Sales
-            top10 = df_products.nlargest(10, "sales")
+            top10 = top_k_rows(df_products, "sales", 10)
             fig_top10 = px.bar(
                 top10,
                 x="sales",
@@ -409,7 +622,7 @@ with tab3:
             st.plotly_chart(fig_top10, use_container_width=True)
 
             # Bottom 10 Products by Profit
-            bottom10 = df_products.nsmallest(10, "profit")
+            bottom10 = top_k_rows(df_products, "profit", 10, largest=False)
             fig_bottom10 = px.bar(
                 bottom10,
                 x="profit",
@@ -457,12 +670,14 @@ with tab3:
 with tab4:
     st.header("Customer & Regional Insights Dashboard")
 
-    # --- Filter delivered orders ---
-    df_paid = df_enriched[df_enriched.get("order_status") == "delivered"].copy() \
+    # --- Filter delivered orders (only the columns Tab 4 reads) ---
+    tab4_cols = [c for c in ["customer_id", "customer_city", "customer_state", "payment_value"]
+                 if c in df_enriched.columns]
+    df_paid = df_enriched.loc[df_enriched["order_status"] == "delivered", tab4_cols] \
         if "order_status" in df_enriched.columns else df_enriched.iloc[0:0].copy()
 
-    # --- Merge customer info (ensure proper join key) ---
-    if not df_customers.empty:
+    # --- Merge customer info (ensure proper join key), unless load_data already joined it ---
+    if not df_customers.empty and "customer_state" not in df_paid.columns:
         if "customer_id" in df_customers.columns and "customer_id" in df_paid.columns:
             join_key = "customer_id"
         elif "customer_unique_id" in df_customers.columns and "customer_id" in df_paid.columns:
@@ -483,60 +698,30 @@ with tab4:
     if "customer_state" not in df_paid.columns:
         df_paid["customer_state"] = "Unknown"
     else:
-        df_paid["customer_state"] = df_paid["customer_state"].fillna("Unknown")
+        customer_state = df_paid["customer_state"]
+        if isinstance(customer_state.dtype, pd.CategoricalDtype) and "Unknown" not in customer_state.cat.categories:
+            customer_state = customer_state.cat.add_categories("Unknown")
+        df_paid["customer_state"] = customer_state.fillna("Unknown")
 
     if "segment" not in df_paid.columns:
-        segments = ["Consumer", "Corporate", "Home Office"]
-        df_paid["segment"] = np.random.choice(segments, size=len(df_paid))
+        # Demo segment from a hash of customer_id: vectorized and stable across reruns
+        customer_hash = pd.util.hash_pandas_object(df_paid["customer_id"], index=False).to_numpy()
+        df_paid["segment"] = SEGMENTS[customer_hash % len(SEGMENTS)]
 
     if "payment_value" not in df_paid.columns:
         df_paid["payment_value"] = 0.0
 
-    # --- Convert timestamps to months ---
-    if "order_purchase_timestamp" in df_paid.columns:
-        df_paid["month"] = pd.to_datetime(df_paid["order_purchase_timestamp"], errors="coerce").dt.to_period("M").astype(str)
-    else:
-        df_paid["month"] = "Unknown"
-
-    # --- Metrics ---
-    total_customers = df_customers["customer_unique_id"].nunique() \
-        if "customer_unique_id" in df_customers.columns else \
-        (df_customers["customer_id"].nunique() if "customer_id" in df_customers.columns else 0)
-
-    total_sales_paid = df_paid["payment_value"].sum() if "payment_value" in df_paid.columns else 0.0
-    total_orders_enriched = len(df_enriched)
-    avg_order_value = (total_sales_paid / len(df_paid)) if len(df_paid) > 0 else 0.0
-    customer_ltv = avg_order_value * 5  # simple assumption
-
-    # --- Top customer and top region ---
-    top_customer = "N/A"
-    if len(df_paid) > 0 and "customer_id" in df_paid.columns and "payment_value" in df_paid.columns:
-        try:
-            top_customer = df_paid.groupby("customer_id", observed=True)["payment_value"].sum().idxmax()
-        except Exception:
-            top_customer = "N/A"
-
-    top_region = "N/A"
-    if "customer_state" in df_paid.columns and len(df_paid) > 0:
-        valid_regions = df_paid[df_paid["customer_state"] != "Unknown"]
-        if not valid_regions.empty:
-            try:
-                top_region = valid_regions.groupby("customer_state", observed=True)["payment_value"].sum().idxmax()
-            except Exception:
-                top_region = "N/A"
-        else:
-            top_region = "Unknown"
-
     returning_rate = 20.0  # simulated rate for demo
+    top_customer = kpis["top_customer"]
 
     # --- KPI Section ---
     col1, col2, col3, col4, col5, col6 = st.columns(6)
-    col1.metric("Total Customers", total_customers)
+    col1.metric("Total Customers", kpis["total_customers"])
     col2.metric("Top Customer (by Sales)",
                 str(top_customer)[:10] + "..." if isinstance(top_customer, str) and len(str(top_customer)) > 10 else str(top_customer))
     col4.metric("Returning Customer Rate %", f"{returning_rate:.2f}%")
-    col5.metric("Avg Order Value", f"R${avg_order_value:.2f}")
-    col6.metric("Customer LTV Estimate", f"R${customer_ltv:.2f}")
+    col5.metric("Avg Order Value", f"R${kpis['avg_order_value']:.2f}")
+    col6.metric("Customer LTV Estimate", f"R${kpis['customer_ltv']:.2f}")
 
     st.markdown("---")
 